@@ -78,7 +78,7 @@ def download(directory, filename):
   return filepath
 
 
-def dataset(directory, images_file, labels_file):
+def dataset(directory, images_file, labels_file, num_parallel_calls=1):
   """Download and parse MNIST dataset."""
 
   images_file = download(directory, images_file)
@@ -100,18 +100,21 @@ def dataset(directory, images_file, labels_file):
     return tf.to_int32(label)
 
   images = tf.data.FixedLengthRecordDataset(
-      images_file, 28 * 28, header_bytes=16).map(decode_image)
+      images_file, 28 * 28, header_bytes=16).map(
+          decode_image, num_parallel_calls=num_parallel_calls)
   labels = tf.data.FixedLengthRecordDataset(
-      labels_file, 1, header_bytes=8).map(decode_label)
+      labels_file, 1, header_bytes=8).map(
+          decode_label, num_parallel_calls=num_parallel_calls)
   return tf.data.Dataset.zip((images, labels))
 
 
-def train(directory):
+def train(directory, num_parallel_calls=1):
   """tf.data.Dataset object for MNIST training data."""
   return dataset(directory, 'train-images-idx3-ubyte',
-                 'train-labels-idx1-ubyte')
+                 'train-labels-idx1-ubyte', num_parallel_calls)
 
 
-def test(directory):
+def test(directory, num_parallel_calls=1):
   """tf.data.Dataset object for MNIST test data."""
-  return dataset(directory, 't10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte')
+  return dataset(directory, 't10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte',
+                 num_parallel_calls)
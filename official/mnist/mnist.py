@@ -18,33 +18,46 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import contextlib
+import os
 import sys
 
 import tensorflow as tf  # pylint: disable=g-bad-import-order
 
 from official.mnist import dataset
 from official.utils.arg_parsers import parsers
+from official.utils.export import export
 from official.utils.logs import hooks_helper
 from official.utils.misc import model_helpers
 
 LEARNING_RATE = 1e-4
 
+# Low precision dtypes whose variables are stored in fp32 and cast on read.
+CASTABLE_TYPES = (tf.float16,)
 
-def create_model(data_format):
+
+def create_model(data_format, share_dropout_mask=False):
   """Model to recognize digits in the MNIST dataset.
 
-  Network structure is equivalent to:
+  Network structure is based on:
   https://github.com/tensorflow/tensorflow/blob/r1.5/tensorflow/examples/tutorials/mnist/mnist_deep.py
   and
   https://github.com/tensorflow/models/blob/master/tutorials/image/mnist/convolutional.py
 
-  But uses the tf.keras API.
+  But uses the tf.keras API, and downsamples with stride 2 convolutions instead
+  of separate 2x2 max pooling layers. The spatial dimensions are reduced the
+  same way (28 -> 14 -> 7), but each convolution and its downsampling happen
+  in a single kernel, which avoids writing and re-reading the full resolution
+  activations.
 
   Args:
     data_format: Either 'channels_first' or 'channels_last'. 'channels_first' is
       typically faster on GPUs while 'channels_last' is typically faster on
       CPUs. See
       https://www.tensorflow.org/performance/performance_guide#data_formats
+    share_dropout_mask: If True, the dropout mask is broadcast across the
+      batch, so every example in a batch drops the same hidden units. This
+      draws far fewer random numbers per step, but changes the regularization.
 
   Returns:
     A tf.keras.Model.
@@ -56,8 +69,8 @@ def create_model(data_format):
     input_shape = [28, 28, 1]
 
   l = tf.keras.layers
-  max_pool = l.MaxPooling2D(
-      (2, 2), (2, 2), padding='same', data_format=data_format)
+  hidden = l.Dense(1024, activation=tf.nn.relu)
+  noise_shape = (1, hidden.units) if share_dropout_mask else None
   # The model consists of a sequential chain of layers, so tf.keras.Sequential
   # (a subclass of tf.keras.Model) makes for a compact description.
   return tf.keras.Sequential(
@@ -66,84 +79,208 @@ def create_model(data_format):
           l.Conv2D(
               32,
               5,
+              strides=2,
               padding='same',
               data_format=data_format,
               activation=tf.nn.relu),
-          max_pool,
           l.Conv2D(
               64,
               5,
+              strides=2,
               padding='same',
               data_format=data_format,
               activation=tf.nn.relu),
-          max_pool,
           l.Flatten(),
-          l.Dense(1024, activation=tf.nn.relu),
-          l.Dropout(0.4),
+          hidden,
+          l.Dropout(0.4, noise_shape=noise_shape),
           l.Dense(10)
       ])
 
 
+def _custom_dtype_getter(getter, name, shape=None, dtype=tf.float32,
+                         *args, **kwargs):
+  """Creates variables in fp32, then casts to fp16 if necessary.
+
+  This mirrors the custom getter used by the ResNet models: the Keras layers
+  request variables in the dtype of their inputs, but applying small gradients
+  to fp16 variables may cause them not to change, so the master copy of each
+  weight is kept in fp32.
+
+  Args:
+    getter: The underlying variable getter, that has the same signature as
+      tf.get_variable and returns a variable.
+    name: The name of the variable to get.
+    shape: The shape of the variable to get.
+    dtype: The dtype of the variable to get.
+    *args: Additional arguments to pass unmodified to getter.
+    **kwargs: Additional keyword arguments to pass unmodified to getter.
+
+  Returns:
+    A variable which is cast to fp16 if necessary.
+  """
+  if dtype in CASTABLE_TYPES:
+    var = getter(name, shape, tf.float32, *args, **kwargs)
+    return tf.cast(var, dtype=dtype, name=name + '_cast')
+  else:
+    return getter(name, shape, dtype, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def _xla_scope(use_xla):
+  """Marks the ops created in this scope for XLA compilation if use_xla."""
+  if use_xla:
+    with tf.contrib.compiler.jit.experimental_jit_scope():
+      yield
+  else:
+    yield
+
+
+def _inference(model, image, use_xla=False):
+  """Runs the model in inference mode.
+
+  MNIST images have a static shape, so when XLA is enabled the whole forward
+  pass is marked for compilation as a single cluster instead of relying on
+  auto-clustering, which tends to split small Keras models into many clusters.
+
+  Args:
+    model: the tf.keras.Model returned by create_model.
+    image: a batch of input images.
+    use_xla: whether to compile the forward pass with XLA.
+
+  Returns:
+    The logits Tensor.
+  """
+  with _xla_scope(use_xla):
+    return model(image, training=False)
+
+
 def model_fn(features, labels, mode, params):
   """The model_fn argument for creating an Estimator."""
-  model = create_model(params['data_format'])
+  model = create_model(params['data_format'],
+                       params.get('share_dropout_mask', False))
   image = features
   if isinstance(image, dict):
     image = features['image']
 
+  # The Keras layers compute in the dtype of their inputs, so casting the
+  # image is enough to run the whole network in low precision. Variables are
+  # still created in fp32 by the custom getter.
+  image = tf.cast(image, params.get('dtype', tf.float32))
+
+  # The logits are computed once and shared by the predictions, the loss and
+  # the metrics below.
+  with tf.variable_scope(tf.get_variable_scope(),
+                         custom_getter=_custom_dtype_getter):
+    if mode == tf.estimator.ModeKeys.TRAIN:
+      with _xla_scope(params.get('use_xla')):
+        logits = model(image, training=True)
+    else:
+      logits = _inference(model, image, params.get('use_xla'))
+
+  # This acts as a no-op if the logits are already in fp32. If dtype is low
+  # precision, logits must be cast to fp32 for numerical stability.
+  logits = tf.cast(logits, tf.float32)
+
   if mode == tf.estimator.ModeKeys.PREDICT:
-    logits = model(image, training=False)
+    # The argmax of the logits is the argmax of the softmax, so the softmax is
+    # only part of the predictions when the probabilities are requested.
+    probabilities = tf.nn.softmax(logits)
     predictions = {
-        'classes': tf.argmax(logits, axis=1),
-        'probabilities': tf.nn.softmax(logits),
+        'classes': tf.argmax(logits, axis=1, output_type=tf.int32),
     }
+    if params.get('export_softmax', True):
+      predictions['probabilities'] = probabilities
+    classify = tf.estimator.export.PredictOutput(predictions)
+    serving_default = (
+        tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY)
     return tf.estimator.EstimatorSpec(
         mode=tf.estimator.ModeKeys.PREDICT,
         predictions=predictions,
         export_outputs={
-            'classify': tf.estimator.export.PredictOutput(predictions)
+            serving_default: classify,
+            'classify': classify,
+            # A signature with a single float output, for converters such as
+            # TensorFlow Lite that quantize every output they convert.
+            'probabilities': tf.estimator.export.PredictOutput({
+                'probabilities': probabilities
+            }),
         })
+
+  # Use the fused softmax + cross entropy kernel, which XLA lowers to a single
+  # reduction over the logits. Unlike tf.losses, it requires rank-1 labels.
+  labels = tf.reshape(labels, [-1])
+  loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(
+      labels=labels, logits=logits))
+
   if mode == tf.estimator.ModeKeys.TRAIN:
     optimizer = tf.train.AdamOptimizer(learning_rate=LEARNING_RATE)
 
-    # If we are running multi-GPU, we need to wrap the optimizer.
-    if params.get('multi_gpu'):
-      optimizer = tf.contrib.estimator.TowerOptimizer(optimizer)
-
-    logits = model(image, training=True)
-    loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
     accuracy = tf.metrics.accuracy(
-        labels=labels, predictions=tf.argmax(logits, axis=1))
+        labels=labels,
+        predictions=tf.argmax(logits, axis=1, output_type=tf.int32))
 
     # Name tensors to be logged with LoggingTensorHook.
     tf.identity(LEARNING_RATE, 'learning_rate')
     tf.identity(loss, 'cross_entropy')
     tf.identity(accuracy[1], name='train_accuracy')
 
-    # Save accuracy scalar to Tensorboard output.
+    # Save scalars to Tensorboard output. These are written by the Estimator's
+    # summary saver without any per-step Python callbacks.
+    tf.summary.scalar('learning_rate', LEARNING_RATE)
+    tf.summary.scalar('cross_entropy', loss)
     tf.summary.scalar('train_accuracy', accuracy[1])
 
+    global_step = tf.train.get_or_create_global_step()
+    loss_scale = params.get('loss_scale', 1)
+
+    # Compile the gradient computation together with the forward pass above.
+    # The Adam updates are applied outside of the XLA scope: they operate on
+    # reference variables, which XLA does not cluster.
+    with _xla_scope(params.get('use_xla')):
+      if loss_scale != 1:
+        # When computing fp16 gradients, often intermediate tensor values are
+        # so small, they underflow to 0. To avoid this, we multiply the loss by
+        # loss_scale to make these tensor values loss_scale times bigger.
+        scaled_grad_vars = optimizer.compute_gradients(loss * loss_scale)
+
+        # Once the gradient computation is complete we can scale the gradients
+        # back to the correct scale before passing them to the optimizer.
+        grad_vars = [(grad / loss_scale, var)
+                     for grad, var in scaled_grad_vars]
+      else:
+        grad_vars = optimizer.compute_gradients(loss)
+
+    train_op = optimizer.apply_gradients(grad_vars, global_step)
+
     return tf.estimator.EstimatorSpec(
         mode=tf.estimator.ModeKeys.TRAIN,
         loss=loss,
-        train_op=optimizer.minimize(loss, tf.train.get_or_create_global_step()))
+        train_op=train_op)
   if mode == tf.estimator.ModeKeys.EVAL:
-    logits = model(image, training=False)
-    loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
     return tf.estimator.EstimatorSpec(
         mode=tf.estimator.ModeKeys.EVAL,
         loss=loss,
         eval_metric_ops={
             'accuracy':
                 tf.metrics.accuracy(
-                    labels=labels, predictions=tf.argmax(logits, axis=1)),
+                    labels=labels,
+                    predictions=tf.argmax(
+                        logits, axis=1, output_type=tf.int32)),
         })
 
 
+def get_num_gpus():
+  """Returns the number of GPUs visible to TensorFlow."""
+  from tensorflow.python.client import device_lib  # pylint: disable=g-import-not-at-top
+
+  local_device_protos = device_lib.list_local_devices()
+  return sum([1 for d in local_device_protos if d.device_type == 'GPU'])
+
+
 def validate_batch_size_for_multi_gpu(batch_size):
   """For multi-gpu, batch-size must be a multiple of the number of GPUs.
 
-  Note that this should eventually be handled by replicate_model_fn
+  Note that this should eventually be handled by MirroredStrategy
   directly. Multi-GPU support is currently experimental, however,
   so doing the work here until that feature is in place.
 
@@ -153,10 +290,7 @@ def validate_batch_size_for_multi_gpu(batch_size):
   Raises:
     ValueError: if no GPUs are found, or selected batch_size is invalid.
   """
-  from tensorflow.python.client import device_lib  # pylint: disable=g-import-not-at-top
-
-  local_device_protos = device_lib.list_local_devices()
-  num_gpus = sum([1 for d in local_device_protos if d.device_type == 'GPU'])
+  num_gpus = get_num_gpus()
   if not num_gpus:
     raise ValueError('Multi-GPU mode was specified, but no GPUs '
                      'were found. To use CPU, run without --multi_gpu.')
@@ -170,33 +304,137 @@ def validate_batch_size_for_multi_gpu(batch_size):
     raise ValueError(err)
 
 
-def main(argv):
-  parser = MNISTArgParser()
-  flags = parser.parse_args(args=argv[1:])
+def per_tower_batch_size(batch_size, multi_gpu):
+  """Returns the batch size of each tower's train input_fn.
 
-  model_function = model_fn
+  With MirroredStrategy, each GPU reads its own batches from the input_fn, so
+  the global batch size is split evenly across the GPUs.
 
-  if flags.multi_gpu:
-    validate_batch_size_for_multi_gpu(flags.batch_size)
+  Args:
+    batch_size: the global number of examples processed in each training step.
+    multi_gpu: whether the model is trained on all available GPUs.
+
+  Returns:
+    The number of examples in each batch of the train input_fn.
+
+  Raises:
+    ValueError: if no GPUs are found, or batch_size is invalid for multi-GPU.
+  """
+  if not multi_gpu:
+    return batch_size
+  validate_batch_size_for_multi_gpu(batch_size)
+  return batch_size // get_num_gpus()
 
-    # There are two steps required if using multi-GPU: (1) wrap the model_fn,
-    # and (2) wrap the optimizer. The first happens here, and (2) happens
-    # in the model_fn itself when the optimizer is defined.
-    model_function = tf.contrib.estimator.replicate_model_fn(
-        model_fn, loss_reduction=tf.losses.Reduction.MEAN)
+
+def construct_estimator(flags):
+  """Creates the MNIST Estimator, including its session configuration.
+
+  Args:
+    flags: namespace object returned by MNISTArgParser.
+
+  Returns:
+    A tf.estimator.Estimator.
+  """
+  use_gpu = tf.test.is_built_with_cuda()
+  num_gpus = get_num_gpus()
 
   data_format = flags.data_format
   if data_format is None:
-    data_format = ('channels_first'
-                   if tf.test.is_built_with_cuda() else 'channels_last')
-  mnist_classifier = tf.estimator.Estimator(
-      model_fn=model_function,
+    data_format = 'channels_first' if use_gpu else 'channels_last'
+
+  # Soft placement is required for multi-GPU, but otherwise only allowed on
+  # CPU so that it cannot silently hide ops that failed to land on the GPU.
+  session_config = tf.ConfigProto(
+      allow_soft_placement=flags.multi_gpu or not use_gpu,
+      log_device_placement=flags.debug_placement)
+  # Let XLA cluster and fuse the element-wise ops (ReLU, BiasAdd, softmax)
+  # into the surrounding conv/matmul kernels. This reduces memory traffic and
+  # kernel launches on GPU, but has shown no gain on CPU, so it is only
+  # enabled when a GPU is present. A CUDA build on a host without GPUs runs on
+  # the CPU.
+  use_xla = num_gpus > 0
+  if use_xla:
+    session_config.graph_options.optimizer_options.global_jit_level = (
+        tf.OptimizerOptions.ON_1)
+
+  distribution = None
+  if flags.multi_gpu:
+    # The model has well under 1 MB of gradients, so a single NCCL all-reduce
+    # over one packed tensor is cheaper than one all-reduce per variable. This
+    # is the tf.contrib.distribute API of TensorFlow 1.12; later versions
+    # rename AllReduceCrossTowerOps to AllReduceCrossDeviceOps.
+    distribution = tf.contrib.distribute.MirroredStrategy(
+        num_gpus=num_gpus,
+        cross_tower_ops=tf.contrib.distribute.AllReduceCrossTowerOps(
+            all_reduce_alg='nccl', num_packs=1))
+
+  run_config = tf.estimator.RunConfig(
+      train_distribute=distribution, session_config=session_config)
+  return tf.estimator.Estimator(
+      model_fn=model_fn,
       model_dir=flags.model_dir,
+      config=run_config,
       params={
           'data_format': data_format,
-          'multi_gpu': flags.multi_gpu
+          'use_xla': use_xla,
+          'dtype': flags.dtype,
+          'loss_scale': flags.loss_scale,
+          'export_softmax': not flags.classes_only,
+          'share_dropout_mask': flags.share_dropout_mask
       })
 
+
+def representative_images(data_dir, num_images=100):
+  """Reads single MNIST test images for calibrating int8 quantization.
+
+  All images are read before returning, so that the graph and session used to
+  read them are not left open while the converter iterates over the images.
+
+  Args:
+    data_dir: the directory containing the MNIST dataset.
+    num_images: the number of images to read.
+
+  Returns:
+    A list of num_images lists, each holding one float32 array of shape
+    [1, 28, 28].
+  """
+  with tf.Graph().as_default(), tf.Session() as sess:
+    images, _ = dataset.test(data_dir).take(num_images).batch(
+        1).make_one_shot_iterator().get_next()
+    images = tf.reshape(images, [1, 28, 28])
+    return [[sess.run(images)] for _ in range(num_images)]
+
+
+def main(argv):
+  parser = MNISTArgParser()
+  flags = parser.parse_args(args=argv[1:])
+
+  # Tensor Cores are only used for GEMMs/convolutions whose dimensions are
+  # multiples of 8, so round the batch size up accordingly. A fixed batch size
+  # is also what lets XLA reuse its compiled kernels from step to step.
+  remainder = flags.batch_size % 8
+  if remainder:
+    flags.batch_size += 8 - remainder
+    tf.logging.info('Rounded batch_size up to %d.', flags.batch_size)
+
+  train_batch_size = per_tower_batch_size(flags.batch_size, flags.multi_gpu)
+
+  mnist_classifier = construct_estimator(flags)
+
+  # Check that the TensorFlow Lite model can be written before training rather
+  # than after it.
+  if flags.export_tflite and not export.supports_int8_tflite():
+    raise ValueError(
+        '--export_tflite requires TensorFlow 1.15, whose tf.lite API can '
+        'quantize a model fully to int8.')
+  # TensorFlow Lite only supports channels_last convolutions.
+  if (flags.export_tflite and
+      mnist_classifier.params['data_format'] == 'channels_first'):
+    raise ValueError(
+        '--export_tflite requires a channels_last model, but the model uses '
+        'channels_first (the default when TensorFlow is built with CUDA). '
+        'Pass --data_format channels_last to export a TensorFlow Lite model.')
+
   # Set up training and evaluation input functions.
   def train_input_fn():
     """Prepare data for training."""
@@ -204,21 +442,30 @@ def main(argv):
     # When choosing shuffle buffer sizes, larger sizes result in better
     # randomness, while smaller sizes use less memory. MNIST is a small
     # enough dataset that we can easily shuffle the full epoch.
-    ds = dataset.train(flags.data_dir)
-    ds = ds.cache().shuffle(buffer_size=50000).batch(flags.batch_size)
+    ds = dataset.train(flags.data_dir, flags.num_parallel_calls)
+    ds = ds.cache().shuffle(buffer_size=50000).apply(
+        tf.contrib.data.batch_and_drop_remainder(train_batch_size))
 
     # Iterate through the dataset a set number (`epochs_between_evals`) of times
     # during each training session.
     ds = ds.repeat(flags.epochs_between_evals)
-    return ds
 
+    # Prefetch a batch so that input processing overlaps with the training
+    # step instead of running synchronously on the critical path.
+    return ds.prefetch(1)
+
+  # Unlike training, evaluation keeps the final partial batch so that the
+  # accuracy covers the whole test set. This costs one extra XLA compilation.
   def eval_input_fn():
-    return dataset.test(flags.data_dir).batch(
-        flags.batch_size).make_one_shot_iterator().get_next()
+    ds = dataset.test(flags.data_dir, flags.num_parallel_calls).batch(
+        flags.batch_size)
+    return ds.prefetch(1).make_one_shot_iterator().get_next()
 
-  # Set up hook that outputs training logs every 100 steps.
+  # Set up hook that outputs training logs every 30 seconds. MNIST steps only
+  # take a few milliseconds, so logging every N steps would interrupt the
+  # training loop with Python callbacks far too often.
   train_hooks = hooks_helper.get_train_hooks(
-      flags.hooks, batch_size=flags.batch_size)
+      flags.hooks, batch_size=flags.batch_size, log_every_n_secs=30)
 
   # Train and evaluate model.
   for _ in range(flags.train_epochs // flags.epochs_between_evals):
@@ -230,13 +477,31 @@ def main(argv):
                                          eval_results['accuracy']):
       break
 
-  # Export the model
+  # Export the model. The serving inputs have a static batch dimension so
+  # that XLA compiles the model once rather than for every new request size.
+  # Two SavedModels are written: one for batches of --batch_size images, and
+  # one for single images, which serves latency-sensitive requests.
   if flags.export_dir is not None:
-    image = tf.placeholder(tf.float32, [None, 28, 28])
-    input_fn = tf.estimator.export.build_raw_serving_input_receiver_fn({
-        'image': image,
-    })
-    mnist_classifier.export_savedmodel(flags.export_dir, input_fn)
+    for batch_size, export_dir in [
+        (flags.batch_size, flags.export_dir),
+        (1, os.path.join(flags.export_dir, 'single_image'))]:
+      image = tf.placeholder(tf.float32, [batch_size, 28, 28])
+      input_fn = tf.estimator.export.build_raw_serving_input_receiver_fn({
+          'image': image,
+      }, default_batch_size=batch_size)
+      saved_model_dir = mnist_classifier.export_savedmodel(export_dir, input_fn)
+
+      # Also save a frozen GraphDef with constants folded and unused nodes
+      # stripped, so that serving does not redo this work on every load.
+      export.optimize_saved_model_for_inference(saved_model_dir, 'classify')
+
+    # The single image SavedModel is exported last by the loop above. Its
+    # 'probabilities' signature is converted, since the int32 classes of the
+    # 'classify' signature cannot be quantized.
+    if flags.export_tflite:
+      images = representative_images(flags.data_dir)
+      export.convert_saved_model_to_int8_tflite(
+          saved_model_dir, 'probabilities', lambda: iter(images))
 
 
 class MNISTArgParser(argparse.ArgumentParser):
@@ -245,16 +510,51 @@ class MNISTArgParser(argparse.ArgumentParser):
   def __init__(self):
     super(MNISTArgParser, self).__init__(parents=[
         parsers.BaseParser(),
+        parsers.PerformanceParser(
+            inter_op=False, intra_op=False, use_synthetic_data=False,
+            max_train_steps=False),
         parsers.ImageModelParser(),
         parsers.ExportParser(),
     ])
 
+    self.add_argument(
+        '--debug_placement', action='store_true',
+        help='If set, log the device placement of every op. This is useful '
+             'for debugging, but adds overhead to every step.')
+
+    self.add_argument(
+        '--classes_only', action='store_true',
+        help='If set, predictions and the exported SavedModel only contain '
+             'the predicted classes, skipping the softmax probabilities.')
+
+    self.add_argument(
+        '--share_dropout_mask', action='store_true',
+        help='If set, every example in a batch drops the same hidden units. '
+             'This draws far fewer random numbers per step, but changes the '
+             'regularization of the model.')
+
+    self.add_argument(
+        '--export_tflite', action='store_true',
+        help='If set along with --export_dir, also convert the single image '
+             'SavedModel to a fully int8 quantized TensorFlow Lite model. '
+             'Requires TensorFlow 1.15, and --data_format channels_last on '
+             'GPU builds.')
+
     self.set_defaults(
         data_dir='/tmp/mnist_data',
         model_dir='/tmp/mnist_model',
-        batch_size=100,
+        batch_size=128,
         train_epochs=40)
 
+  def parse_args(self, args=None, namespace=None):
+    args = super(MNISTArgParser, self).parse_args(
+        args=args, namespace=namespace)
+
+    # handle coupling between dtype and loss_scale
+    parsers.parse_dtype_info(args)
+
+    return args
+
 
 if __name__ == '__main__':
   tf.logging.set_verbosity(tf.logging.INFO)
@@ -18,10 +18,13 @@ from __future__ import division
 from __future__ import print_function
 
 import time
+import unittest
 
+import numpy as np
 import tensorflow as tf  # pylint: disable=g-bad-import-order
 
 from official.mnist import mnist
+from official.utils.export import export
 
 BATCH_SIZE = 100
 
@@ -64,45 +67,172 @@ class Tests(tf.test.TestCase):
       self.assertEqual(predictions['probabilities'].shape, (10,))
       self.assertEqual(predictions['classes'].shape, ())
 
-  def mnist_model_fn_helper(self, mode, multi_gpu=False):
-    features, labels = dummy_input_fn()
-    image_count = features.shape[0]
-    spec = mnist.model_fn(features, labels, mode, {
-        'data_format': 'channels_last',
-        'multi_gpu': multi_gpu
-    })
-
-    if mode == tf.estimator.ModeKeys.PREDICT:
-      predictions = spec.predictions
-      self.assertAllEqual(predictions['probabilities'].shape, (image_count, 10))
-      self.assertEqual(predictions['probabilities'].dtype, tf.float32)
-      self.assertAllEqual(predictions['classes'].shape, (image_count,))
-      self.assertEqual(predictions['classes'].dtype, tf.int64)
-
-    if mode != tf.estimator.ModeKeys.PREDICT:
-      loss = spec.loss
-      self.assertAllEqual(loss.shape, ())
-      self.assertEqual(loss.dtype, tf.float32)
-
-    if mode == tf.estimator.ModeKeys.EVAL:
-      eval_metric_ops = spec.eval_metric_ops
-      self.assertAllEqual(eval_metric_ops['accuracy'][0].shape, ())
-      self.assertAllEqual(eval_metric_ops['accuracy'][1].shape, ())
-      self.assertEqual(eval_metric_ops['accuracy'][0].dtype, tf.float32)
-      self.assertEqual(eval_metric_ops['accuracy'][1].dtype, tf.float32)
+  def _mnist_model_fn_helper(self, mode, dtype, export_softmax=True):
+    with tf.Graph().as_default() as g:
+      features, labels = dummy_input_fn()
+      image_count = features.shape[0]
+      spec = mnist.model_fn(features, labels, mode, {
+          'data_format': 'channels_last',
+          'export_softmax': export_softmax,
+          'dtype': dtype,
+          'loss_scale': 128 if dtype == tf.float16 else 1
+      })
+
+      if mode == tf.estimator.ModeKeys.PREDICT:
+        predictions = spec.predictions
+        if export_softmax:
+          self.assertAllEqual(predictions['probabilities'].shape,
+                              (image_count, 10))
+          self.assertEqual(predictions['probabilities'].dtype, tf.float32)
+        else:
+          self.assertNotIn('probabilities', predictions)
+        self.assertAllEqual(predictions['classes'].shape, (image_count,))
+        self.assertEqual(predictions['classes'].dtype, tf.int32)
+
+        # The probabilities signature is exported even without the softmax in
+        # the predictions, and has a single float output.
+        outputs = spec.export_outputs['probabilities'].outputs
+        self.assertEqual(list(outputs), ['probabilities'])
+        self.assertAllEqual(outputs['probabilities'].shape, (image_count, 10))
+        self.assertEqual(outputs['probabilities'].dtype, tf.float32)
+
+      if mode != tf.estimator.ModeKeys.PREDICT:
+        loss = spec.loss
+        self.assertAllEqual(loss.shape, ())
+        self.assertEqual(loss.dtype, tf.float32)
+
+      if mode == tf.estimator.ModeKeys.EVAL:
+        eval_metric_ops = spec.eval_metric_ops
+        self.assertAllEqual(eval_metric_ops['accuracy'][0].shape, ())
+        self.assertAllEqual(eval_metric_ops['accuracy'][1].shape, ())
+        self.assertEqual(eval_metric_ops['accuracy'][0].dtype, tf.float32)
+        self.assertEqual(eval_metric_ops['accuracy'][1].dtype, tf.float32)
+
+      if mode == tf.estimator.ModeKeys.TRAIN:
+        self.assertIsNotNone(spec.train_op)
+
+      for v in tf.trainable_variables():
+        self.assertEqual(v.dtype.base_dtype, tf.float32)
+
+      # The convolutions and matmuls are computed in the requested dtype.
+      compute_ops = [op for op in g.get_operations()
+                     if op.type in ('Conv2D', 'MatMul')]
+      self.assertTrue(compute_ops)
+      for op in compute_ops:
+        self.assertEqual(op.outputs[0].dtype, dtype,
+                         'Op {} has dtype {}, while dtype {} was '
+                         'expected'.format(op.name, op.outputs[0].dtype,
+                                           dtype))
+
+  def mnist_model_fn_helper(self, mode, export_softmax=True):
+    self._mnist_model_fn_helper(mode, dtype=tf.float32,
+                                export_softmax=export_softmax)
+    self._mnist_model_fn_helper(mode, dtype=tf.float16,
+                                export_softmax=export_softmax)
 
   def test_mnist_model_fn_train_mode(self):
     self.mnist_model_fn_helper(tf.estimator.ModeKeys.TRAIN)
 
-  def test_mnist_model_fn_train_mode_multi_gpu(self):
-    self.mnist_model_fn_helper(tf.estimator.ModeKeys.TRAIN, multi_gpu=True)
-
   def test_mnist_model_fn_eval_mode(self):
     self.mnist_model_fn_helper(tf.estimator.ModeKeys.EVAL)
 
   def test_mnist_model_fn_predict_mode(self):
     self.mnist_model_fn_helper(tf.estimator.ModeKeys.PREDICT)
 
+  def test_mnist_model_fn_predict_mode_classes_only(self):
+    self.mnist_model_fn_helper(tf.estimator.ModeKeys.PREDICT,
+                               export_softmax=False)
+
+  @unittest.skipUnless(export.supports_int8_tflite(),
+                       'requires the tf.lite API of TensorFlow 1.15')
+  def test_mnist_int8_tflite(self):
+    classifier = tf.estimator.Estimator(
+        model_fn=mnist.model_fn, params={
+            'data_format': 'channels_last',
+            'export_softmax': False
+        })
+    classifier.train(input_fn=dummy_input_fn, steps=1)
+
+    image = tf.placeholder(tf.float32, [1, 28, 28])
+    input_fn = tf.estimator.export.build_raw_serving_input_receiver_fn({
+        'image': image,
+    }, default_batch_size=1)
+    saved_model_dir = classifier.export_savedmodel(
+        self.get_temp_dir(), input_fn)
+
+    images = [[np.random.uniform(size=(1, 28, 28)).astype(np.float32)]
+              for _ in range(10)]
+    path = export.convert_saved_model_to_int8_tflite(
+        saved_model_dir, 'probabilities', lambda: iter(images))
+
+    interpreter = tf.lite.Interpreter(model_path=path)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()
+    output_details = interpreter.get_output_details()
+    self.assertEqual(len(input_details), 1)
+    self.assertEqual(len(output_details), 1)
+    self.assertEqual(input_details[0]['dtype'], np.int8)
+    self.assertEqual(output_details[0]['dtype'], np.int8)
+    self.assertAllEqual(input_details[0]['shape'], [1, 28, 28])
+    self.assertAllEqual(output_details[0]['shape'], [1, 10])
+
+  def test_create_model_dropout_noise_shape(self):
+    for share_dropout_mask, noise_shape in [(False, None), (True, (1, 1024))]:
+      model = mnist.create_model('channels_last', share_dropout_mask)
+      dropout = [layer for layer in model.layers
+                 if isinstance(layer, tf.keras.layers.Dropout)]
+      self.assertEqual(len(dropout), 1)
+      self.assertEqual(dropout[0].noise_shape, noise_shape)
+
+  def _with_num_gpus(self, num_gpus, fn, *args):
+    """Calls fn(*args) as if num_gpus GPUs were visible."""
+    get_num_gpus = mnist.get_num_gpus
+    mnist.get_num_gpus = lambda: num_gpus
+    try:
+      return fn(*args)
+    finally:
+      mnist.get_num_gpus = get_num_gpus
+
+  def _construct_estimator(self, num_gpus, *args):
+    """Runs construct_estimator as if num_gpus GPUs were visible."""
+    flags = mnist.MNISTArgParser().parse_args(
+        ['--model_dir', self.get_temp_dir()] + list(args))
+    return self._with_num_gpus(num_gpus, mnist.construct_estimator, flags)
+
+  def test_construct_estimator_without_gpu(self):
+    # This is also the case for CUDA builds on a host without GPUs.
+    classifier = self._construct_estimator(0)
+    optimizer_options = (
+        classifier.config.session_config.graph_options.optimizer_options)
+    self.assertEqual(optimizer_options.global_jit_level,
+                     tf.OptimizerOptions.DEFAULT)
+    self.assertFalse(classifier.params['use_xla'])
+
+  def test_construct_estimator_with_gpu(self):
+    classifier = self._construct_estimator(1)
+    optimizer_options = (
+        classifier.config.session_config.graph_options.optimizer_options)
+    self.assertEqual(optimizer_options.global_jit_level,
+                     tf.OptimizerOptions.ON_1)
+    self.assertTrue(classifier.params['use_xla'])
+    self.assertIsNone(classifier.config.train_distribute)
+
+  def test_construct_estimator_multi_gpu(self):
+    classifier = self._construct_estimator(2, '--multi_gpu')
+    self.assertIsInstance(classifier.config.train_distribute,
+                          tf.contrib.distribute.MirroredStrategy)
+    self.assertTrue(classifier.config.session_config.allow_soft_placement)
+
+  def test_per_tower_batch_size(self):
+    self.assertEqual(
+        self._with_num_gpus(4, mnist.per_tower_batch_size, 128, False), 128)
+    self.assertEqual(
+        self._with_num_gpus(4, mnist.per_tower_batch_size, 128, True), 32)
+    with self.assertRaises(ValueError):
+      self._with_num_gpus(3, mnist.per_tower_batch_size, 128, True)
+    with self.assertRaises(ValueError):
+      self._with_num_gpus(0, mnist.per_tower_batch_size, 128, True)
+
 
 class Benchmarks(tf.test.Benchmark):
   """Simple speed benchmarking for MNIST."""
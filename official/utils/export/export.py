@@ -18,8 +18,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 import tensorflow as tf
 
+# Graph Transform Tool passes applied by optimize_saved_model_for_inference.
+DEFAULT_INFERENCE_TRANSFORMS = [
+    "strip_unused_nodes",
+    "fold_constants(ignore_errors=true)",
+    "fold_batch_norms",
+]
+
 
 def build_tensor_serving_input_receiver_fn(shape, dtype=tf.float32,
                                            batch_size=1):
@@ -47,3 +56,100 @@ def build_tensor_serving_input_receiver_fn(shape, dtype=tf.float32,
         features=features, receiver_tensors=features)
 
   return serving_input_receiver_fn
+
+
+def optimize_saved_model_for_inference(saved_model_dir, signature_def_key,
+                                       transforms=None,
+                                       output_name="optimized_graph.pb"):
+  """Writes a frozen, inference-optimized GraphDef next to a SavedModel.
+
+  The variables of the SavedModel are folded into constants, and the graph is
+  then rewritten with the Graph Transform Tool (by default stripping unused
+  nodes and folding constants and batch norms), so that this work does not
+  have to be redone every time an inference server loads the model.
+
+  Args:
+    saved_model_dir: directory of the SavedModel, as returned by
+      Estimator.export_savedmodel.
+    signature_def_key: key of the SignatureDef whose inputs and outputs should
+      be kept.
+    transforms: list of Graph Transform Tool transforms to apply. Defaults to
+      DEFAULT_INFERENCE_TRANSFORMS.
+    output_name: file name of the optimized GraphDef, written inside
+      saved_model_dir.
+
+  Returns:
+    The path of the optimized GraphDef.
+  """
+  from tensorflow.tools.graph_transforms import TransformGraph  # pylint: disable=g-import-not-at-top
+
+  saved_model_dir = tf.compat.as_str(saved_model_dir)
+  with tf.Graph().as_default() as graph, tf.Session() as sess:
+    meta_graph_def = tf.saved_model.loader.load(
+        sess, [tf.saved_model.tag_constants.SERVING], saved_model_dir)
+    signature_def = meta_graph_def.signature_def[signature_def_key]
+    input_names = [t.name.split(":")[0]
+                   for t in signature_def.inputs.values()]
+    output_names = [t.name.split(":")[0]
+                    for t in signature_def.outputs.values()]
+    frozen_graph_def = tf.graph_util.convert_variables_to_constants(
+        sess, graph.as_graph_def(), output_names)
+
+  optimized_graph_def = TransformGraph(
+      frozen_graph_def, input_names, output_names,
+      transforms or DEFAULT_INFERENCE_TRANSFORMS)
+  tf.train.write_graph(optimized_graph_def, saved_model_dir, output_name,
+                       as_text=False)
+  return os.path.join(saved_model_dir, output_name)
+
+
+def supports_int8_tflite():
+  """Returns whether TensorFlow can write fully int8 TensorFlow Lite models.
+
+  convert_saved_model_to_int8_tflite needs the tf.lite API of TensorFlow 1.15,
+  which calibrates activation ranges on a representative dataset. TensorFlow
+  1.12, which the official models target, only provides tf.contrib.lite, whose
+  post-training quantization is limited to the weights.
+  """
+  ops_set = getattr(getattr(tf, "lite", None), "OpsSet", None)
+  return hasattr(ops_set, "TFLITE_BUILTINS_INT8")
+
+
+def convert_saved_model_to_int8_tflite(saved_model_dir, signature_def_key,
+                                       representative_dataset,
+                                       output_name="model_int8.tflite"):
+  """Writes a fully int8 quantized TensorFlow Lite model next to a SavedModel.
+
+  Weights and activations are quantized to int8, with the activation ranges
+  calibrated on representative_dataset. The float inputs and outputs of the
+  model become int8 as well, so callers quantize inputs and dequantize outputs
+  with the scale and zero point stored in the model. This requires TensorFlow
+  1.15; see supports_int8_tflite. The SavedModel must only use ops with
+  TensorFlow Lite builtins, which excludes channels_first convolutions.
+
+  Args:
+    saved_model_dir: directory of the SavedModel, as returned by
+      Estimator.export_savedmodel.
+    signature_def_key: key of the SignatureDef to convert.
+    representative_dataset: a callable returning a generator, which yields
+      lists with one numpy array per model input, shaped like those inputs.
+    output_name: file name of the TensorFlow Lite model, written inside
+      saved_model_dir.
+
+  Returns:
+    The path of the TensorFlow Lite model.
+  """
+  saved_model_dir = tf.compat.as_str(saved_model_dir)
+  converter = tf.lite.TFLiteConverter.from_saved_model(
+      saved_model_dir, signature_key=signature_def_key)
+  converter.optimizations = [tf.lite.Optimize.DEFAULT]
+  converter.representative_dataset = tf.lite.RepresentativeDataset(
+      representative_dataset)
+  converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+  converter.inference_input_type = tf.int8
+  converter.inference_output_type = tf.int8
+
+  path = os.path.join(saved_model_dir, output_name)
+  with tf.gfile.GFile(path, "wb") as f:
+    f.write(converter.convert())
+  return path
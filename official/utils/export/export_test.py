@@ -18,6 +18,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import unittest
+
+import numpy as np
 import tensorflow as tf  # pylint: disable=g-bad-import-order
 
 from official.utils.export import export
@@ -58,6 +62,68 @@ class ExportUtilsTest(tf.test.TestCase):
       self.assertEqual(list(receiver.receiver_tensors.values())[0].shape,
                        tf.TensorShape([10, 4, 5]))
 
+  def _build_saved_model(self):
+    """Saves a SavedModel computing output = input * (2 * weights)."""
+    export_dir = os.path.join(self.get_temp_dir(), "saved_model")
+    with tf.Graph().as_default(), tf.Session() as sess:
+      x = tf.placeholder(tf.float32, [1, 3], name="input")
+      w = tf.Variable(tf.ones([3, 2]), name="weights")
+      y = tf.matmul(x, w * 2.0, name="output")
+      sess.run(tf.global_variables_initializer())
+
+      builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+      builder.add_meta_graph_and_variables(
+          sess, [tf.saved_model.tag_constants.SERVING],
+          signature_def_map={
+              "serving_default":
+                  tf.saved_model.signature_def_utils.predict_signature_def(
+                      inputs={"x": x}, outputs={"y": y})
+          })
+      builder.save()
+    return export_dir
+
+  def test_optimize_saved_model_for_inference(self):
+    export_dir = self._build_saved_model()
+    path = export.optimize_saved_model_for_inference(
+        export_dir, "serving_default")
+    self.assertEqual(path, os.path.join(export_dir, "optimized_graph.pb"))
+
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path, "rb") as f:
+      graph_def.ParseFromString(f.read())
+    op_types = set(node.op for node in graph_def.node)
+    self.assertNotIn("VariableV2", op_types)
+    self.assertNotIn("Mul", op_types)
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+      tf.import_graph_def(graph_def, name="")
+      result = sess.run("output:0", feed_dict={"input:0": [[1., 2., 3.]]})
+      self.assertAllClose(result, [[12., 12.]])
+
+  @unittest.skipUnless(export.supports_int8_tflite(),
+                       "requires the tf.lite API of TensorFlow 1.15")
+  def test_convert_saved_model_to_int8_tflite(self):
+    export_dir = self._build_saved_model()
+
+    def representative_dataset():
+      for _ in range(10):
+        yield [np.random.uniform(size=(1, 3)).astype(np.float32)]
+
+    path = export.convert_saved_model_to_int8_tflite(
+        export_dir, "serving_default", representative_dataset)
+    self.assertEqual(path, os.path.join(export_dir, "model_int8.tflite"))
+
+    interpreter = tf.lite.Interpreter(model_path=path)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()
+    output_details = interpreter.get_output_details()
+    self.assertEqual(len(input_details), 1)
+    self.assertEqual(len(output_details), 1)
+    self.assertEqual(input_details[0]["dtype"], np.int8)
+    self.assertEqual(output_details[0]["dtype"], np.int8)
+    self.assertAllEqual(input_details[0]["shape"], [1, 3])
+    self.assertAllEqual(output_details[0]["shape"], [1, 2])
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -65,12 +65,21 @@ def get_train_hooks(name_list, **kwargs):
   return train_hooks
 
 
-def get_logging_tensor_hook(every_n_iter=100, tensors_to_log=None, **kwargs):  # pylint: disable=unused-argument
+def get_logging_tensor_hook(every_n_iter=100, log_every_n_secs=None,
+                            tensors_to_log=None, **kwargs):  # pylint: disable=unused-argument
   """Function to get LoggingTensorHook.
 
+  The keyword arguments of get_train_hooks are passed to every hook, so the
+  time-based option is named log_every_n_secs rather than every_n_secs, which
+  get_logging_metric_hook already takes.
+
   Args:
     every_n_iter: `int`, print the values of `tensors` once every N local
-      steps taken on the current worker.
+      steps taken on the current worker. Ignored if log_every_n_secs is set.
+    log_every_n_secs: `int` or `float`, if set, print the values of `tensors`
+      once every N seconds instead. This is preferable for models with very
+      short steps, where fetching the tensors every N steps stalls the training
+      loop frequently.
     tensors_to_log: List of tensor names or dictionary mapping labels to tensor
       names. If not set, log _TENSORS_TO_LOG by default.
     **kwargs: a dictionary of arguments to LoggingTensorHook.
@@ -82,6 +91,11 @@ def get_logging_tensor_hook(every_n_iter=100, tensors_to_log=None, **kwargs):  #
   if tensors_to_log is None:
     tensors_to_log = _TENSORS_TO_LOG
 
+  if log_every_n_secs is not None:
+    return tf.train.LoggingTensorHook(
+        tensors=tensors_to_log,
+        every_n_secs=log_every_n_secs)
+
   return tf.train.LoggingTensorHook(
       tensors=tensors_to_log,
       every_n_iter=every_n_iter)
@@ -51,6 +51,17 @@ class BaseTest(unittest.TestCase):
   def test_get_train_hooks_logging_tensor_hook(self):
     self.validate_train_hook_name('LoggingTensorHook', 'loggingtensorhook')
 
+  def test_get_train_hooks_logging_tensor_hook_every_n_secs(self):
+    tensor_hook, metric_hook = hooks_helper.get_train_hooks(
+        ['LoggingTensorHook', 'LoggingMetricHook'],
+        log_every_n_secs=30, benchmark_log_dir='/tmp')
+    # pylint: disable=protected-access
+    self.assertEqual(tensor_hook._timer._every_secs, 30)
+    self.assertIsNone(tensor_hook._timer._every_steps)
+    # LoggingMetricHook keeps its own default frequency.
+    self.assertEqual(metric_hook._timer._every_secs, 600)
+    # pylint: enable=protected-access
+
   def test_get_train_hooks_profiler_hook(self):
     self.validate_train_hook_name('ProfilerHook', 'profilerhook')
 